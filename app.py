@@ -1,28 +1,133 @@
+try:
+    # Must happen before anything imports socket/ssl so outbound Roblox calls
+    # cooperate instead of pinning a gevent worker.
+    from gevent import monkey
+    monkey.patch_all()
+except ImportError:
+    pass
+
+import atexit
+import collections
 import os
+import queue
 import sqlite3
-from flask import Flask, request, jsonify
-import datetime
+import threading
+import time
+from flask import Flask, g, has_app_context, request, jsonify
+from flask.json.provider import JSONProvider
+
 import json
 import requests
 import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    def _json_dumps(obj):
+        return orjson.dumps(obj).decode('utf-8')
+    _json_loads = orjson.loads
+else:
+    _json_dumps = json.dumps
+    _json_loads = json.loads
+
 load_dotenv()
-logging.basicConfig(level=logging.INFO, filename='flask_api.log', format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Log records are handed to a background listener thread so request handlers
+# never block on log-file I/O.
+_log_queue = queue.Queue(-1)
+_log_file_handler = RotatingFileHandler('flask_api.log', maxBytes=10_000_000, backupCount=5)
+_log_file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+# Attached to the root logger directly: basicConfig would give the queue
+# handler its own formatter, whose output QueueHandler.prepare() bakes into
+# the record before the listener's file handler formats it a second time.
+_root_logger = logging.getLogger()
+_root_logger.setLevel(logging.INFO)
+_root_logger.addHandler(QueueHandler(_log_queue))
+_log_listener = QueueListener(_log_queue, _log_file_handler)
+_log_listener.start()
+# The listener runs on a daemon thread; drain whatever is still queued when
+# the worker exits cleanly instead of losing it.
+atexit.register(_log_listener.stop)
 logger = logging.getLogger('flask_api')
 
+class OrjsonProvider(JSONProvider):
+    """JSON provider backed by orjson so request parsing and jsonify avoid stdlib json."""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+if orjson is not None:
+    app.json = OrjsonProvider(app)
 DATABASE = os.getenv("DATABASE_PATH", "xp_data.db")
 
-def get_db_connection():
+# Under the gevent workers this app deploys with, threading.local is
+# greenlet-local, so a thread-local connection would not outlive its request
+# greenlet and a traffic burst could hold hundreds of un-closed connections.
+# Requests instead check a connection out of a bounded pool and return it at
+# teardown; overflow connections beyond the pool size are closed on return.
+_DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+_db_pool = queue.Queue(maxsize=_DB_POOL_SIZE)
+_db_local = threading.local()  # long-lived background threads only
+
+def _open_db_connection():
     try:
-        conn = sqlite3.connect(DATABASE, detect_types=sqlite3.PARSE_DECLTYPES)
+        conn = sqlite3.connect(DATABASE, detect_types=sqlite3.PARSE_DECLTYPES,
+                               check_same_thread=False, cached_statements=256)
         conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA cache_size=-65536")
+        conn.execute("PRAGMA busy_timeout=5000")
+        # Raised from the 1000-page default so request-path writes almost
+        # never absorb a checkpoint; the background writer checkpoints instead.
+        conn.execute("PRAGMA wal_autocheckpoint=4000")
         return conn
     except sqlite3.Error as e:
-        logger.error(f"Database connection error: {str(e)}")
+        logger.error("Database connection error: %s", e)
         raise
 
+def get_db_connection():
+    """Return the calling context's SQLite connection, opening one if needed.
+
+    Inside a request the connection comes from the pool and is held on
+    flask.g until teardown returns it, so one request reuses one connection
+    (and its prepared-statement cache) across statements. Outside a request
+    (startup, the background writer) the calling thread keeps a private
+    long-lived connection.
+    """
+    if has_app_context():
+        conn = g.get('_db_conn')
+        if conn is None:
+            try:
+                conn = _db_pool.get_nowait()
+            except queue.Empty:
+                conn = _open_db_connection()
+            g._db_conn = conn
+        return conn
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None:
+        conn = _open_db_connection()
+        _db_local.conn = conn
+    return conn
+
+@app.teardown_appcontext
+def _release_db_connection(exc):
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        try:
+            _db_pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
 def init_db():
     try:
         conn = get_db_connection()
@@ -33,7 +138,7 @@ def init_db():
                     username TEXT NOT NULL,
                     xp INTEGER NOT NULL,
                     offenseData TEXT,
-                    last_updated TEXT
+                    last_updated INTEGER
                 )
             """)
             conn.execute("""
@@ -41,17 +146,290 @@ def init_db():
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     userId TEXT,
                     xp_change INTEGER,
-                    timestamp TEXT,
+                    timestamp INTEGER,
                     FOREIGN KEY (userId) REFERENCES xp_data(userId)
                 )
             """)
-        conn.close()
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_history_user_time ON xp_history(userId, timestamp DESC)")
+            # Covers the /leaderboard query so the top-N read never sorts or
+            # touches the table.
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_xp_desc ON xp_data(xp DESC, username)")
+            # History rows are produced by the engine itself: every XP change
+            # logs its delta in the same statement context as the write.
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_xp_history_update
+                AFTER UPDATE OF xp ON xp_data WHEN NEW.xp <> OLD.xp
+                BEGIN
+                    INSERT INTO xp_history (userId, xp_change, timestamp)
+                    VALUES (NEW.userId, NEW.xp - OLD.xp, NEW.last_updated);
+                END
+            """)
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_xp_history_insert
+                AFTER INSERT ON xp_data WHEN NEW.xp <> 0
+                BEGIN
+                    INSERT INTO xp_history (userId, xp_change, timestamp)
+                    VALUES (NEW.userId, NEW.xp, NEW.last_updated);
+                END
+            """)
+        # Pre-lowercased username maintained by the engine; added via ALTER in
+        # its own transaction because the table predates the column and a
+        # duplicate-column error would roll back everything above.
+        try:
+            with conn:
+                conn.execute("ALTER TABLE xp_data ADD COLUMN username_lc TEXT "
+                             "GENERATED ALWAYS AS (LOWER(username)) VIRTUAL")
+        except sqlite3.OperationalError:
+            pass  # column already exists
+        with conn:
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_xp_data_username_lc ON xp_data(username_lc)")
+            conn.execute("DROP INDEX IF EXISTS idx_xp_data_username_lower")
     except sqlite3.Error as e:
-        logger.error(f"Database initialization error: {str(e)}")
+        logger.error("Database initialization error: %s", e)
         raise
 
 init_db()
 
+_UPSERT_XP_SQL = """
+    INSERT INTO xp_data (userId, username, xp, offenseData, last_updated)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(userId) DO UPDATE SET
+        username=excluded.username,
+        xp=excluded.xp,
+        offenseData=excluded.offenseData,
+        last_updated=excluded.last_updated
+"""
+# Explicit column lists keep the generated username_lc column out of responses.
+_SELECT_USER_SQL = "SELECT userId, username, xp, offenseData, last_updated FROM xp_data WHERE username_lc = ?"
+_LEADERBOARD_SQL = "SELECT username, xp FROM xp_data ORDER BY xp DESC LIMIT ?"
+_CREATE_NAMES_SQL = "CREATE TEMP TABLE IF NOT EXISTS _names (n TEXT PRIMARY KEY)"
+_CLEAR_NAMES_SQL = "DELETE FROM _names"
+_INSERT_NAME_SQL = "INSERT OR IGNORE INTO _names (n) VALUES (?)"
+_JOIN_NAMES_SQL = ("SELECT d.userId, d.username, d.xp, d.offenseData, d.last_updated "
+                   "FROM xp_data d JOIN _names n ON d.username_lc = n.n")
+_SET_XP_UPDATE_SQL = "UPDATE xp_data SET xp = ?, last_updated = unixepoch() WHERE userId = ? RETURNING username, last_updated"
+
+# /update_xp writes are queued and flushed in batches by a background thread so
+# bursty bot traffic pays one transaction (and one fsync) per batch instead of
+# per request. Queued records stay visible to reads via the _pending overlay
+# until they land in the database.
+_write_queue = queue.Queue()
+_pending = {}  # userId -> queued record
+_pending_by_username = {}  # username.lower() -> userId
+_pending_lock = threading.Lock()
+_FLUSH_INTERVAL = float(os.getenv("XP_FLUSH_INTERVAL", "0.02"))
+_FLUSH_BATCH = 256
+_CHECKPOINT_INTERVAL = 30.0
+
+def _get_pending(username_lower):
+    with _pending_lock:
+        user_id = _pending_by_username.get(username_lower)
+        return _pending.get(user_id) if user_id is not None else None
+
+# Records whose flush failed twice land here instead of being silently lost;
+# they stay out of reads but remain available for operator recovery.
+_failed_writes = []
+
+def _drain_writes():
+    conn = get_db_connection()
+    # This connection only ever writes, so open its transactions with BEGIN
+    # IMMEDIATE: the write lock is taken at BEGIN (waiting out busy_timeout
+    # there) instead of part-way through the batch.
+    conn.isolation_level = "IMMEDIATE"
+    next_checkpoint = time.monotonic() + _CHECKPOINT_INTERVAL
+    retried = set()  # id() of records already re-queued after one failed flush
+    while True:
+        records = [_write_queue.get()]
+        deadline = time.monotonic() + _FLUSH_INTERVAL
+        while len(records) < _FLUSH_BATCH:
+            try:
+                records.append(_write_queue.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        # Coalesce to the last record per user so history holds one net delta
+        # per user per batch instead of repeated pre-batch comparisons.
+        latest = {rec['userId']: rec for rec in records}
+        retired = [rec for rec in records if latest[rec['userId']] is not rec]
+        retried.difference_update(id(rec) for rec in retired)
+        try:
+            with conn:
+                conn.executemany(_UPSERT_XP_SQL,
+                                 [(rec['userId'], rec['username'], rec['xp'], rec['offenseData'], rec['last_updated'])
+                                  for rec in latest.values()])
+        except sqlite3.Error as e:
+            logger.error("Error flushing XP write batch: %s", e)
+            # These writes were already acknowledged with a 202, so a
+            # transient SQLITE_BUSY/disk error must not drop them: re-queue
+            # each record once, and park second-time failures for recovery.
+            for rec in latest.values():
+                if id(rec) in retried:
+                    retried.discard(id(rec))
+                    _failed_writes.append(rec)
+                    retired.append(rec)
+                    logger.error("Abandoning XP write for user %s after retry", rec['userId'])
+                else:
+                    retried.add(id(rec))
+                    _write_queue.put(rec)
+        else:
+            retried.difference_update(id(rec) for rec in latest.values())
+            retired.extend(latest.values())
+        finally:
+            _leaderboard_cache_clear()
+            with _pending_lock:
+                for rec in retired:
+                    if _pending.get(rec['userId']) is rec:
+                        del _pending[rec['userId']]
+                        key = rec['username'].lower()
+                        if _pending_by_username.get(key) == rec['userId']:
+                            del _pending_by_username[key]
+        # Move WAL pages back into the main db off the request path, keeping
+        # the file small and checkpoint pauses out of request-time writes.
+        if time.monotonic() >= next_checkpoint:
+            try:
+                conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+            except sqlite3.Error as e:
+                logger.error("WAL checkpoint failed: %s", e)
+            next_checkpoint = time.monotonic() + _CHECKPOINT_INTERVAL
+
+threading.Thread(target=_drain_writes, name='xp-writer', daemon=True).start()
+
+# ETags for the polled read endpoints are hashed from the response body, so
+# the same payload yields the same tag in every worker and a stale tag can
+# never match a changed body. If-None-Match hits still skip sending the bytes.
+def _conditional(resp):
+    resp.add_etag()
+    return resp.make_conditional(request)
+
+# /get_user_data is dominated by a handful of hot usernames, so keep the last
+# responses in a small LRU above the index lookup. Writes invalidate by userId
+# in-process; the TTL bounds how long another worker's write can go unseen,
+# since cross-process writes cannot invalidate this cache.
+_USER_CACHE_SIZE = 1024
+_USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "5"))
+_user_cache = collections.OrderedDict()  # username.lower() -> (expires, payload)
+_user_cache_keys = {}  # userId -> cached username.lower()
+_user_cache_lock = threading.Lock()
+
+def _user_cache_get(key):
+    with _user_cache_lock:
+        hit = _user_cache.get(key)
+        if hit is None:
+            return None
+        expires, payload = hit
+        if expires <= time.monotonic():
+            del _user_cache[key]
+            _user_cache_keys.pop(payload['userId'], None)
+            return None
+        _user_cache.move_to_end(key)
+        return payload
+
+def _user_cache_put(key, payload):
+    with _user_cache_lock:
+        _user_cache[key] = (time.monotonic() + _USER_CACHE_TTL, payload)
+        _user_cache.move_to_end(key)
+        _user_cache_keys[payload['userId']] = key
+        while len(_user_cache) > _USER_CACHE_SIZE:
+            _, (_, evicted) = _user_cache.popitem(last=False)
+            _user_cache_keys.pop(evicted['userId'], None)
+
+def _user_cache_invalidate(user_id):
+    with _user_cache_lock:
+        key = _user_cache_keys.pop(user_id, None)
+        if key is not None:
+            _user_cache.pop(key, None)
+
+# /leaderboard returns the same payload to every caller for a given limit, so
+# cache it briefly. Writes clear the cache so ranks track visible writes.
+_LEADERBOARD_TTL = float(os.getenv("LEADERBOARD_CACHE_TTL", "5"))
+_leaderboard_cache = {}  # limit -> (expires, payload)
+_leaderboard_lock = threading.Lock()
+
+def _leaderboard_cache_get(limit):
+    with _leaderboard_lock:
+        hit = _leaderboard_cache.get(limit)
+        if hit is not None and hit[0] > time.monotonic():
+            return hit[1]
+        return None
+
+def _leaderboard_cache_put(limit, payload):
+    with _leaderboard_lock:
+        _leaderboard_cache[limit] = (time.monotonic() + _LEADERBOARD_TTL, payload)
+
+def _leaderboard_cache_clear():
+    with _leaderboard_lock:
+        _leaderboard_cache.clear()
+
+# One keep-alive session for all outbound Roblox calls so repeated requests
+# reuse pooled TCP+TLS connections instead of handshaking per call.
+_http = requests.Session()
+# pool_maxsize tracks the gevent worker-connections order of magnitude so
+# concurrent greenlets are not serialized on a tiny connection pool.
+_http.mount('https://', requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=50))
+
+# Short-TTL cache for Roblox GETs, keyed by URL. Clients retry these lookups
+# frequently (rank checks, verification), so reusing the last response for a
+# few seconds removes most of the 100-300ms upstream round-trips.
+_ROBLOX_CACHE_TTL = float(os.getenv("ROBLOX_CACHE_TTL", "30"))
+# Group role lists change rarely, so they get a much longer TTL than
+# per-user membership lookups.
+_ROBLOX_ROLES_CACHE_TTL = float(os.getenv("ROBLOX_ROLES_CACHE_TTL", "300"))
+_roblox_cache = {}  # url -> (expires, parsed body)
+_roblox_cache_lock = threading.Lock()
+
+def _roblox_get_json(url, headers, ttl=_ROBLOX_CACHE_TTL):
+    now = time.monotonic()
+    with _roblox_cache_lock:
+        hit = _roblox_cache.get(url)
+        if hit is not None and hit[0] > now:
+            return hit[1]
+    resp = _http.get(url, headers=headers, timeout=10)
+    resp.raise_for_status()
+    # Parse the raw bytes directly: resp.json() first decodes to str (with
+    # charset detection) before parsing, which is wasted work on these
+    # sometimes-large group/role payloads.
+    data = _json_loads(resp.content)
+    with _roblox_cache_lock:
+        if len(_roblox_cache) >= 10_000:
+            _roblox_cache.clear()
+        _roblox_cache[url] = (now + ttl, data)
+    return data
+
+# Stable error bodies are serialized once and reused, so the rejection paths
+# skip jsonify and dict construction entirely.
+_error_body_cache = {}
+
+def _error_response(message, status=400):
+    body = _error_body_cache.get(message)
+    if body is None:
+        body = _json_dumps({'error': message})
+        _error_body_cache[message] = body
+    return app.response_class(body, status=status, mimetype='application/json')
+
+def _validate_xp_write(data, require_username=True):
+    """Shared validation for the XP write payloads.
+
+    Returns (fields, error): on success fields holds the coerced values, on
+    failure error is the message for a 400 response. Field checks live here
+    once instead of being re-spelled per handler.
+    """
+    if not isinstance(data, dict):
+        return None, 'Invalid JSON body'
+    user_id = data.get('userId')
+    username = data.get('username')
+    xp = data.get('xp')
+    if user_id is None or xp is None or (require_username and not username):
+        return None, 'Missing required data' if require_username else 'Missing userId or xp'
+    # userId 0 is a valid (if unlikely) Roblox id, but '' and non-scalar
+    # types would otherwise be coerced into junk row keys by str() below.
+    if not isinstance(user_id, (str, int)) or isinstance(user_id, bool) or user_id == '':
+        return None, 'Invalid userId'
+    if username is not None and not isinstance(username, str):
+        return None, 'Username must be a string'
+    if not isinstance(xp, int) or isinstance(xp, bool) or xp < 0:
+        return None, 'XP must be a non-negative integer'
+    return {'user_id': str(user_id), 'username': username, 'xp': xp,
+            'offense_data': data.get('offenseData')}, None
+
 @app.route('/', methods=['HEAD', 'GET'])
 def health_check():
     return jsonify({"status": "ok"}), 200
@@ -59,40 +437,58 @@ def health_check():
 @app.route('/update_xp', methods=['POST'])
 def update_xp():
     try:
-        data = request.get_json()
-        user_id = data.get('userId')
-        username = data.get('username')
-        xp = data.get('xp')
-        offense_data = data.get('offenseData')
-        if not all([user_id, username, xp is not None]):
-            return jsonify({'error': 'Missing required data'}), 400
-        if not isinstance(xp, int) or xp < 0:
-            return jsonify({'error': 'XP must be a non-negative integer'}), 400
-        last_updated = datetime.datetime.utcnow().isoformat()
-        offense_json = json.dumps(offense_data) if offense_data is not None else None
-        conn = get_db_connection()
-        with conn:
-            cur = conn.execute("SELECT xp FROM xp_data WHERE userId = ?", (str(user_id),))
-            row = cur.fetchone()
-            old_xp = row['xp'] if row else 0
-            xp_change = xp - old_xp
-            conn.execute("""
-                INSERT INTO xp_data (userId, username, xp, offenseData, last_updated)
-                VALUES (?, ?, ?, ?, ?)
-                ON CONFLICT(userId) DO UPDATE SET
-                    username=excluded.username,
-                    xp=excluded.xp,
-                    offenseData=excluded.offenseData,
-                    last_updated=excluded.last_updated
-            """, (str(user_id), username, xp, offense_json, last_updated))
-            if xp_change != 0:
-                conn.execute("INSERT INTO xp_history (userId, xp_change, timestamp) VALUES (?, ?, ?)",
-                             (str(user_id), xp_change, last_updated))
-        conn.close()
-        logger.info(f"Updated XP for user {user_id}: {xp}")
-        return jsonify({'status': 'success', 'xp': xp, 'last_updated': last_updated})
+        fields, error = _validate_xp_write(request.get_json(silent=True))
+        if error:
+            return _error_response(error)
+        user_id = fields['user_id']
+        username = fields['username']
+        xp = fields['xp']
+        offense_data = fields['offense_data']
+        last_updated = time.time_ns() // 1_000_000_000
+        offense_json = _json_dumps(offense_data) if offense_data is not None else None
+        record = {'userId': user_id, 'username': username, 'xp': xp,
+                  'offenseData': offense_json, 'last_updated': last_updated}
+        with _pending_lock:
+            _pending[record['userId']] = record
+            _pending_by_username[username.lower()] = record['userId']
+        _write_queue.put(record)
+        _user_cache_invalidate(user_id)
+        _leaderboard_cache_clear()
+        logger.info("Queued XP update for user %s: %s", user_id, xp)
+        return jsonify({'status': 'queued', 'xp': xp, 'last_updated': last_updated}), 202
+    except Exception as e:
+        logger.error("Error in update_xp: %s", e)
+        return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
+
+@app.route('/update_xp_bulk', methods=['POST'])
+def update_xp_bulk():
+    try:
+        data = request.get_json(silent=True)
+        users = data.get('users') if isinstance(data, dict) else None
+        if not isinstance(users, list) or not users:
+            return _error_response('users must be a non-empty list')
+        records = []
+        for entry in users:
+            fields, error = _validate_xp_write(entry)
+            if error:
+                return _error_response(error)
+            offense_data = fields['offense_data']
+            records.append({'userId': fields['user_id'], 'username': fields['username'],
+                            'xp': fields['xp'],
+                            'offenseData': _json_dumps(offense_data) if offense_data is not None else None,
+                            'last_updated': time.time_ns() // 1_000_000_000})
+        with _pending_lock:
+            for record in records:
+                _pending[record['userId']] = record
+                _pending_by_username[record['username'].lower()] = record['userId']
+        for record in records:
+            _write_queue.put(record)
+            _user_cache_invalidate(record['userId'])
+        _leaderboard_cache_clear()
+        logger.info("Queued bulk XP update for %s users", len(records))
+        return jsonify({'status': 'queued', 'count': len(records)}), 202
     except Exception as e:
-        logger.error(f"Error in update_xp: {str(e)}")
+        logger.error("Error in update_xp_bulk: %s", e)
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
 @app.route('/get_user_data', methods=['GET'])
@@ -100,71 +496,100 @@ def get_user_data():
     try:
         username = request.args.get('username')
         if not username:
-            return jsonify({'error': 'Username parameter is missing'}), 400
+            return _error_response('Username parameter is missing')
+        key = username.lower()
+        record = _get_pending(key)
+        if record:
+            offense_data = _json_loads(record['offenseData']) if record['offenseData'] else {}
+            return _conditional(jsonify(record | {'offenseData': offense_data}))
+        payload = _user_cache_get(key)
+        if payload is not None:
+            return _conditional(jsonify(payload))
         conn = get_db_connection()
-        cur = conn.execute("SELECT * FROM xp_data WHERE LOWER(username)=?", (username.lower(),))
+        cur = conn.execute(_SELECT_USER_SQL, (key,))
         row = cur.fetchone()
-        conn.close()
         if row:
-            offense_data = json.loads(row['offenseData']) if row['offenseData'] else {}
-            return jsonify(dict(row) | {'offenseData': offense_data})
-        return jsonify({'error': 'User not found'}), 404
+            offense_data = _json_loads(row[3]) if row[3] else {}
+            payload = {'userId': row[0], 'username': row[1], 'xp': row[2],
+                       'offenseData': offense_data, 'last_updated': row[4]}
+            _user_cache_put(key, payload)
+            return _conditional(jsonify(payload))
+        return _error_response('User not found', 404)
     except Exception as e:
-        logger.error(f"Error in get_user_data: {str(e)}")
+        logger.error("Error in get_user_data: %s", e)
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
 @app.route('/get_multiple_user_data', methods=['POST'])
 def get_multiple_user_data():
     try:
-        data = request.get_json()
-        usernames = data.get('usernames', [])
+        data = request.get_json(silent=True)
+        usernames = data.get('usernames') if isinstance(data, dict) else None
         if not usernames or not isinstance(usernames, list):
-            return jsonify({'error': 'Usernames must be a non-empty list'}), 400
+            return _error_response('Usernames must be a non-empty list')
         conn = get_db_connection()
-        placeholders = ','.join(['?' for _ in usernames])
-        cur = conn.execute(f"SELECT * FROM xp_data WHERE LOWER(username) IN ({placeholders})", [u.lower() for u in usernames])
-        rows = cur.fetchall()
-        conn.close()
+        # Stage the names in a per-connection temp table instead of building a
+        # dynamic IN (?,?,...) list: the statements below stay constant, so the
+        # statement cache is reused, and arity is unbounded (IN lists cap at
+        # SQLITE_MAX_VARIABLE_NUMBER). The with block matters: the staging DML
+        # opens an implicit transaction that must not outlive the request, or
+        # this connection's read snapshot would go stale.
+        with conn:
+            conn.execute(_CREATE_NAMES_SQL)
+            conn.execute(_CLEAR_NAMES_SQL)
+            conn.executemany(_INSERT_NAME_SQL, [(u.lower(),) for u in usernames])
+            rows = conn.execute(_JOIN_NAMES_SQL).fetchall()
         result = {}
         for row in rows:
-            offense_data = json.loads(row['offenseData']) if row['offenseData'] else {}
+            offense_data = _json_loads(row['offenseData']) if row['offenseData'] else {}
             result[row['username']] = dict(row) | {'offenseData': offense_data}
+        for u in usernames:
+            record = _get_pending(u.lower())
+            if record:
+                offense_data = _json_loads(record['offenseData']) if record['offenseData'] else {}
+                result[record['username']] = record | {'offenseData': offense_data}
         return jsonify(result)
     except Exception as e:
-        logger.error(f"Error in get_multiple_user_data: {str(e)}")
+        logger.error("Error in get_multiple_user_data: %s", e)
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
 @app.route('/set_xp', methods=['POST'])
 def set_xp():
     try:
-        data = request.get_json()
-        user_id = data.get('userId')
-        new_xp = data.get('xp')
-        if not all([user_id, new_xp is not None]):
-            return jsonify({'error': 'Missing userId or xp'}), 400
-        if not isinstance(new_xp, int) or new_xp < 0:
-            return jsonify({'error': 'XP must be a non-negative integer'}), 400
-        last_updated = datetime.datetime.utcnow().isoformat()
+        fields, error = _validate_xp_write(request.get_json(silent=True), require_username=False)
+        if error:
+            return _error_response(error)
+        user_id = fields['user_id']
+        new_xp = fields['xp']
+        # If an /update_xp for this user is still queued, supersede it in queue
+        # order rather than racing the background flush with a direct UPDATE.
+        with _pending_lock:
+            pending = _pending.get(user_id)
+        if pending:
+            last_updated = time.time_ns() // 1_000_000_000
+            record = pending | {'xp': new_xp, 'last_updated': last_updated}
+            with _pending_lock:
+                _pending[record['userId']] = record
+                _pending_by_username[record['username'].lower()] = record['userId']
+            _write_queue.put(record)
+            _user_cache_invalidate(record['userId'])
+            _leaderboard_cache_clear()
+            logger.info("Set XP for user %s to %s", user_id, new_xp)
+            return jsonify({'status': 'success', 'newXp': new_xp, 'last_updated': last_updated, 'username': record['username']})
         conn = get_db_connection()
         with conn:
-            cur = conn.execute("SELECT xp, username FROM xp_data WHERE userId = ?", (str(user_id),))
+            # The history delta comes from the trg_xp_history_update trigger.
+            cur = conn.execute(_SET_XP_UPDATE_SQL, (new_xp, user_id))
             row = cur.fetchone()
-            if not row:
-                conn.close()
-                return jsonify({'error': 'User not found'}), 404
-            old_xp = row['xp']
-            username = row['username']
-            xp_change = new_xp - old_xp
-            conn.execute("UPDATE xp_data SET xp = ?, last_updated = ? WHERE userId = ?",
-                         (new_xp, last_updated, str(user_id)))
-            if xp_change != 0:
-                conn.execute("INSERT INTO xp_history (userId, xp_change, timestamp) VALUES (?, ?, ?)",
-                             (str(user_id), xp_change, last_updated))
-        conn.close()
-        logger.info(f"Set XP for user {user_id} to {new_xp}")
+        if not row:
+            return _error_response('User not found', 404)
+        username = row['username']
+        last_updated = row['last_updated']
+        _user_cache_invalidate(user_id)
+        _leaderboard_cache_clear()
+        logger.info("Set XP for user %s to %s", user_id, new_xp)
         return jsonify({'status': 'success', 'newXp': new_xp, 'last_updated': last_updated, 'username': username})
     except Exception as e:
-        logger.error(f"Error in set_xp: {str(e)}")
+        logger.error("Error in set_xp: %s", e)
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
 @app.route('/leaderboard', methods=['GET'])
@@ -172,16 +597,22 @@ def get_leaderboard():
     try:
         limit = min(int(request.args.get('limit', 10)), 50)
         if limit <= 0:
-            return jsonify({'error': 'Limit must be positive'}), 400
+            return _error_response('Limit must be positive')
+        body = _leaderboard_cache_get(limit)
+        if body is not None:
+            return _conditional(app.response_class(body, mimetype='application/json'))
         conn = get_db_connection()
-        cur = conn.execute("SELECT username, xp FROM xp_data ORDER BY xp DESC LIMIT ?", (limit,))
-        leaderboard = [dict(row) for row in cur.fetchall()]
-        conn.close()
-        return jsonify({'leaderboard': leaderboard})
+        cur = conn.execute(_LEADERBOARD_SQL, (limit,))
+        # Positional access: sqlite3.Row's dict() conversion does a name lookup
+        # per field, which adds up on the hottest read endpoint. The response
+        # is serialized once per TTL window; cache hits return the bytes as-is.
+        body = _json_dumps({'leaderboard': [{'username': row[0], 'xp': row[1]} for row in cur]})
+        _leaderboard_cache_put(limit, body)
+        return _conditional(app.response_class(body, mimetype='application/json'))
     except ValueError:
-        return jsonify({'error': 'Limit must be an integer'}), 400
+        return _error_response('Limit must be an integer')
     except Exception as e:
-        logger.error(f"Error in get_leaderboard: {str(e)}")
+        logger.error("Error in get_leaderboard: %s", e)
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
 @app.route('/get_group_rank', methods=['GET'])
@@ -189,7 +620,7 @@ def get_group_rank():
     try:
         user_id = request.args.get('userId')
         group_id = request.args.get('groupId')
-        if not all([user_id, group_id]):
+        if not user_id or not group_id:
             return jsonify({'error': 'Missing userId or groupId'}), 400
         roblox_api_key = os.getenv("ROBLOX_API_KEY")
         if not roblox_api_key:
@@ -197,18 +628,16 @@ def get_group_rank():
             return jsonify({'error': 'Server configuration error', 'details': 'ROBLOX_API_KEY not set'}), 500
         url = f"https://groups.roblox.com/v1/users/{user_id}/groups/roles"
         headers = {"Cookie": f".ROBLOSECURITY={roblox_api_key}"}
-        resp = requests.get(url, headers=headers, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
+        data = _roblox_get_json(url, headers)
         for group in data.get("data", []):
             if str(group["group"]["id"]) == str(group_id):
                 return jsonify({"rank": group["role"]["name"], "roleId": group["role"]["id"]})
         return jsonify({"rank": "Not in group", "roleId": 0})
     except requests.RequestException as e:
-        logger.error(f"Error fetching group rank: {str(e)}, response={e.response.text if e.response else 'No response'}")
+        logger.error("Error fetching group rank: %s, response=%s", e, e.response.text if e.response else 'No response')
         return jsonify({'error': 'Failed to fetch group data', 'details': e.response.text if e.response else 'No response'}), 500
     except Exception as e:
-        logger.error(f"Error in get_group_rank: {str(e)}")
+        logger.error("Error in get_group_rank: %s", e)
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
 @app.route('/get_role_id', methods=['GET'])
@@ -216,7 +645,7 @@ def get_role_id():
     try:
         group_id = request.args.get('groupId')
         rank_name = request.args.get('rankName')
-        if not all([group_id, rank_name]):
+        if not group_id or not rank_name:
             return jsonify({'error': 'Missing groupId or rankName'}), 400
         roblox_api_key = os.getenv("ROBLOX_API_KEY")
         if not roblox_api_key:
@@ -224,36 +653,36 @@ def get_role_id():
             return jsonify({'error': 'Server configuration error', 'details': 'ROBLOX_API_KEY not set'}), 500
         url = f"https://groups.roblox.com/v1/groups/{group_id}/roles"
         headers = {"Cookie": f".ROBLOSECURITY={roblox_api_key}"}
-        resp = requests.get(url, headers=headers, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
+        data = _roblox_get_json(url, headers, ttl=_ROBLOX_ROLES_CACHE_TTL)
         for role in data.get("roles", []):
             if role["name"].lower() == rank_name.lower():
                 return jsonify({"roleId": role["id"]})
         return jsonify({'error': 'Rank not found'}), 404
     except requests.RequestException as e:
-        logger.error(f"Error fetching role ID: {str(e)}, response={e.response.text if e.response else 'No response'}")
+        logger.error("Error fetching role ID: %s, response=%s", e, e.response.text if e.response else 'No response')
         return jsonify({'error': 'Failed to fetch role data', 'details': e.response.text if e.response else 'No response'}), 500
     except Exception as e:
-        logger.error(f"Error in get_role_id: {str(e)}")
+        logger.error("Error in get_role_id: %s", e)
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
 @app.route('/set_group_rank', methods=['POST'])
 def set_group_rank():
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Invalid JSON body'}), 400
         user_id = data.get('userId')
         group_id = data.get('groupId')
         role_id = data.get('roleId')
-        if not all([user_id, group_id, role_id]):
-            logger.error(f"Missing parameters: userId={user_id}, groupId={group_id}, roleId={role_id}")
+        if user_id is None or group_id is None or role_id is None:
+            logger.error("Missing parameters: userId=%s, groupId=%s, roleId=%s", user_id, group_id, role_id)
             return jsonify({'error': 'Missing parameters', 'details': 'userId, groupId, or roleId missing'}), 400
         try:
             user_id = int(user_id)
             group_id = int(group_id)
             role_id = int(role_id)
         except ValueError:
-            logger.error(f"Invalid integer parameters: userId={user_id}, groupId={group_id}, roleId={role_id}")
+            logger.error("Invalid integer parameters: userId=%s, groupId=%s, roleId=%s", user_id, group_id, role_id)
             return jsonify({'error': 'Invalid parameters', 'details': 'userId, groupId, and roleId must be integers'}), 400
         roblox_api_key = os.getenv("ROBLOX_API_KEY")
         if not roblox_api_key:
@@ -262,15 +691,15 @@ def set_group_rank():
         url = f"https://groups.roblox.com/v1/groups/{group_id}/users/{user_id}"
         headers = {"Cookie": f".ROBLOSECURITY={roblox_api_key}"}
         payload = {"roleId": role_id}
-        logger.info(f"Sending request to Roblox API: {url}, payload={payload}")
-        resp = requests.patch(url, headers=headers, json=payload, timeout=10)
+        logger.info("Sending request to Roblox API: %s, payload=%s", url, payload)
+        resp = _http.patch(url, headers=headers, json=payload, timeout=10)
         resp.raise_for_status()
-        logger.info(f"Successfully set rank for user {user_id} in group {group_id} to role {role_id}")
+        logger.info("Successfully set rank for user %s in group %s to role %s", user_id, group_id, role_id)
         return jsonify({'status': 'success'})
     except requests.RequestException as e:
         error_msg = str(e)
         response_text = e.response.text if e.response else "No response from Roblox API"
-        logger.error(f"Roblox API error: {error_msg}, response={response_text}")
+        logger.error("Roblox API error: %s, response=%s", error_msg, response_text)
         status_code = e.response.status_code if e.response else 500
         if status_code == 403:
             error_type = 'Permission denied'
@@ -282,7 +711,7 @@ def set_group_rank():
             error_type = 'Failed to set rank'
         return jsonify({'error': error_type, 'details': response_text}), status_code
     except Exception as e:
-        logger.error(f"Unexpected error in set_group_rank: {str(e)}")
+        logger.error("Unexpected error in set_group_rank: %s", e)
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
 if __name__ == "__main__":